@@ -25,7 +25,12 @@ from mctx._src import base
 from mctx._src import qtransforms
 from mctx._src import search
 from mctx._src import seq_halving
-from mctx._src.search import batch_update
+
+# The maximum number of simulations unrolled in one iteration of the
+# simulation loop of `muzero_policy_for_action_sequence`. Each unrolled
+# simulation duplicates the whole simulate/expand/backward body, so larger
+# factors quickly increase the compilation time.
+_MAX_SIMULATIONS_UNROLL = 2
 
 
 def muzero_policy(
@@ -78,14 +83,13 @@ def muzero_policy(
   rng_key, dirichlet_rng_key, search_rng_key = jax.random.split(rng_key, 3)
 
   # Adding Dirichlet noise.
-  noisy_logits = _get_logits_from_probs(
-      _add_dirichlet_noise(
+  root = root.replace(
+      prior_logits=_prepare_root_logits(
           dirichlet_rng_key,
-          jax.nn.softmax(root.prior_logits),
+          root.prior_logits,
+          invalid_actions,
           dirichlet_fraction=dirichlet_fraction,
           dirichlet_alpha=dirichlet_alpha))
-  root = root.replace(
-      prior_logits=_mask_invalid_actions(noisy_logits, invalid_actions))
 
   # Running the search.
   interior_action_selection_fn = functools.partial(
@@ -205,14 +209,13 @@ def muzero_policy_for_action_sequence(
   rng_key, dirichlet_rng_key, search_rng_key = jax.random.split(rng_key, 3)
 
   # Adding Dirichlet noise.
-  noisy_logits = _get_logits_from_probs(
-      _add_dirichlet_noise(
+  root = root.replace(
+      prior_logits=_prepare_root_logits(
           dirichlet_rng_key,
-          jax.nn.softmax(root.prior_logits),
+          root.prior_logits,
+          invalid_actions,
           dirichlet_fraction=dirichlet_fraction,
           dirichlet_alpha=dirichlet_alpha))
-  root = root.replace(
-      prior_logits=_mask_invalid_actions(noisy_logits, invalid_actions))
 
   # Running the search.
   interior_action_selection_fn = functools.partial(
@@ -238,11 +241,10 @@ def muzero_policy_for_action_sequence(
   if invalid_actions is None:
     invalid_actions = jnp.zeros_like(root.prior_logits)
 
-  def generate_next_action_inner(sim, loop_state):
-    rng_key, tree, max_depth = loop_state
-    rng_key, simulate_key, expand_key = jax.random.split(rng_key, 3)
+  def generate_next_action_inner(loop_state, simulation_inputs):
+    tree, max_depth = loop_state
     # simulate is vmapped and expects batched rng keys.
-    simulate_keys = jax.random.split(simulate_key, batch_size)
+    sim, simulate_keys, expand_key = simulation_inputs
     parent_index, action = simulate(
         simulate_keys, tree, action_selection_fn, max_depth)
     # A node first expanded on simulation `i`, will have node index `i`.
@@ -255,38 +257,36 @@ def muzero_policy_for_action_sequence(
         params, expand_key, tree, recurrent_fn, parent_index,
         action, next_node_index)
     tree = backward(tree, next_node_index)
-    loop_state = rng_key, tree, max_depth
-    return loop_state
+    loop_state = tree, max_depth
+    return loop_state, None
 
-  def generate_next_action(generated_action, loop_state):
-    rng_key, tree, max_depth, performed_actions, stop_generating = loop_state
+  def generate_next_action(step_inputs, loop_state):
+    generated_action, sample_key, simulate_keys, expand_keys = step_inputs
+    tree, max_depth, performed_actions, stop_generating = loop_state
 
     # Peform simulations and upate the tree.
-    _, tree, _ = jax.lax.fori_loop(
-      generated_action * num_simulations,
-      (generated_action + 1) * num_simulations,
-      generate_next_action_inner, (rng_key, tree, max_depth))
+    sims = generated_action * num_simulations + jnp.arange(num_simulations)
+    # Unrolling a few simulations lets XLA fuse across their loop bodies.
+    (tree, _), _ = jax.lax.scan(
+      generate_next_action_inner, (tree, max_depth),
+      (sims, simulate_keys, expand_keys),
+      unroll=min(num_simulations, _MAX_SIMULATIONS_UNROLL))
 
     # Sampling the action to be performed proportionally to the visit counts.
     summary = tree.summary()
     action_weights = summary.visit_probs
     action_logits = _apply_temperature(
         _get_logits_from_probs(action_weights), temperature)
-    action = jax.random.categorical(rng_key, action_logits)
+    action = jax.random.categorical(sample_key, action_logits)
 
     # Make the new action and update the root.
-    # TODO refactor/simplify the updating of the root index
-    def update_new_root_index(batch_idx, new_root_index):
-      return new_root_index.at[batch_idx].set(
-        tree.children_index[batch_idx, tree.root_index[batch_idx], action[batch_idx]])
-    new_root_index = jax.lax.fori_loop(0, batch_size, update_new_root_index,
-                                       jnp.full_like(tree.root_index, -1))
+    new_root_index = tree.children_index[batch_range, tree.root_index, action]
 
     # TODO Will qtransforms know how to deal with the updated root?
     tree = tree.replace(
-      root_index=tree.root_index.at[:].set(new_root_index),
+      root_index=new_root_index,
       # Parents of the root are set to Tree.NO_PARENT
-      parents=batch_update(tree.parents, jnp.full((batch_size,), Tree.NO_PARENT), new_root_index),
+      parents=tree.parents.at[batch_range, new_root_index].set(Tree.NO_PARENT),
     )
 
     performed_actions = performed_actions.at[:, generated_action].set(action)
@@ -296,29 +296,47 @@ def muzero_policy_for_action_sequence(
       lambda x: x[batch_range, tree.root_index], tree.embeddings)
     stop_generating = stopping_criteria_fn(root_embedding)
 
-    loop_state = rng_key, tree, max_depth - 1, performed_actions, stop_generating
+    loop_state = tree, max_depth - 1, performed_actions, stop_generating
     return loop_state
 
-  def generate_next_action_stopping_wrapper(generated_action, loop_state):
-    _, _, max_depth, _, stop_generating = loop_state
+  def should_stop_generating(loop_state):
+    _, max_depth, _, stop_generating = loop_state
+    return jnp.logical_or(stop_generating, max_depth == 0)
 
-    # TODO is there a nicer way to crate the simple condition `stop_generating or max_depth==0`?
-    stop_generating_is_true_or_max_depth_is_zero = jax.lax.cond(stop_generating, lambda: True, lambda: max_depth == 0)
-
-    return jax.lax.cond(stop_generating_is_true_or_max_depth_is_zero,
-                        lambda _, x: x, generate_next_action, generated_action, loop_state)
+  def generate_next_action_stopping_wrapper(loop_state, step_inputs):
+    should_stop = should_stop_generating(loop_state)
+    loop_state = jax.lax.cond(should_stop,
+                              lambda _, x: x,
+                              generate_next_action,
+                              step_inputs,
+                              loop_state)
+    return loop_state, None
 
   # Allocate all necessary storage.
   tree = instantiate_tree_from_root(
     root, num_actions_to_generate * num_simulations,
     root_invalid_actions=invalid_actions, extra_data=extra_data)
 
+  # Split the rng keys of all simulations and samplings upfront, instead of
+  # splitting the loop carry on every simulation.
+  sample_keys = jax.random.split(rng_key, num_actions_to_generate)
+  simulate_rng_key, expand_rng_key = jax.random.split(search_rng_key)
+  num_steps = num_actions_to_generate * num_simulations
+  simulate_keys = jax.random.split(simulate_rng_key, num_steps * batch_size)
+  simulate_keys = simulate_keys.reshape(
+    (num_actions_to_generate, num_simulations, batch_size)
+    + simulate_keys.shape[1:])
+  expand_keys = jax.random.split(expand_rng_key, num_steps)
+  expand_keys = expand_keys.reshape(
+    (num_actions_to_generate, num_simulations) + expand_keys.shape[1:])
+
   performed_actions = jnp.full((batch_size, num_actions_to_generate), -1, dtype=jnp.int32)
-  _, tree, _, performed_actions, _ = jax.lax.fori_loop(
-    lower=0,
-    upper=num_actions_to_generate,
-    body_fun=generate_next_action_stopping_wrapper,
-    init_val=(rng_key, tree, max_depth, performed_actions, False),
+  (tree, _, performed_actions, _), _ = _scan_until_stopped(
+    generate_next_action_stopping_wrapper,
+    (tree, max_depth, performed_actions, jnp.array(False)),
+    (jnp.arange(num_actions_to_generate), sample_keys, simulate_keys,
+     expand_keys),
+    should_stop_generating,
   )
 
   return base.PolicyOutput(
@@ -326,6 +344,28 @@ def muzero_policy_for_action_sequence(
       action_weights=jnp.empty((0,)),
       search_tree=tree)
 
+
+def _scan_until_stopped(f, init, xs, should_stop):
+  """Runs `jax.lax.scan(f, init, xs)`, exiting early when running eagerly.
+
+  Under `jax.disable_jit()`, the loop state is concrete and a Python loop can
+  break as soon as `should_stop(carry)` holds, instead of stepping through the
+  remaining iterations. Traced loop states always use `jax.lax.scan`.
+  """
+  is_traced = any(isinstance(x, jax.core.Tracer)
+                  for x in jax.tree_util.tree_leaves(init))
+  if is_traced or not jax.config.jax_disable_jit:
+    return jax.lax.scan(f, init, xs)
+
+  carry = init
+  xs_leaves, xs_treedef = jax.tree_util.tree_flatten(xs)
+  for i in range(xs_leaves[0].shape[0]):
+    if should_stop(carry):
+      break
+    carry, _ = f(carry, xs_treedef.unflatten([x[i] for x in xs_leaves]))
+  return carry, None
+
+
 def gumbel_muzero_policy(
     params: base.Params,
     rng_key: chex.PRNGKey,
@@ -422,9 +462,8 @@ def gumbel_muzero_policy(
   action = action_selection.masked_argmax(to_argmax, invalid_actions)
 
   # Producing action_weights usable to train the policy network.
-  completed_search_logits = _mask_invalid_actions(
-      root.prior_logits + completed_qvalues, invalid_actions)
-  action_weights = jax.nn.softmax(completed_search_logits)
+  action_weights = jnp.exp(_masked_log_softmax(
+      root.prior_logits + completed_qvalues, invalid_actions))
   return base.PolicyOutput(
       action=action,
       action_weights=action_weights,
@@ -440,10 +479,26 @@ def _mask_invalid_actions(logits, invalid_actions):
   # At the end of an episode, all actions can be invalid. A softmax would then
   # produce NaNs, if using -inf for the logits. We avoid the NaNs by using
   # a finite `min_logit` for the invalid actions.
-  min_logit = jnp.finfo(logits.dtype).min
+  min_logit = _min_logit(logits.dtype)
   return jnp.where(invalid_actions, min_logit, logits)
 
 
+def _masked_log_softmax(logits, invalid_actions):
+  """Returns log-probabilities with zero mass to invalid actions."""
+  if invalid_actions is not None:
+    chex.assert_equal_shape([logits, invalid_actions])
+    # The log_softmax subtracts the max itself, so only the masking is needed.
+    min_logit = _min_logit(logits.dtype)
+    logits = jnp.where(invalid_actions, min_logit, logits)
+  return jax.nn.log_softmax(logits, axis=-1)
+
+
+@functools.lru_cache(maxsize=32)
+def _min_logit(dtype):
+  """Returns the finite logit used for invalid actions, cached per dtype."""
+  return jnp.finfo(dtype).min
+
+
 def _get_logits_from_probs(probs):
   tiny = jnp.finfo(probs).tiny
   return jnp.log(jnp.maximum(probs, tiny))
@@ -456,17 +511,79 @@ def _add_dirichlet_noise(rng_key, probs, *, dirichlet_alpha,
   chex.assert_type([dirichlet_alpha, dirichlet_fraction], float)
 
   batch_size, num_actions = probs.shape
-  noise = jax.random.dirichlet(
+  # The concentration is kept in at least float32, so a low-precision `probs`
+  # does not round it. Only the sampled noise is cast to the `probs` dtype.
+  alpha_dtype = jnp.promote_types(probs.dtype, jnp.float32)
+  noise = _fast_dirichlet(
       rng_key,
-      alpha=jnp.full([num_actions], fill_value=dirichlet_alpha),
-      shape=(batch_size,))
+      alpha=jnp.broadcast_to(
+          jnp.asarray(dirichlet_alpha, dtype=alpha_dtype), (num_actions,)),
+      shape=(batch_size,)).astype(probs.dtype)
   noisy_probs = (1 - dirichlet_fraction) * probs + dirichlet_fraction * noise
   return noisy_probs
 
 
+def _fast_dirichlet(rng_key, alpha, shape):
+  """Samples from a Dirichlet distribution with concentration `alpha`.
+
+  This is the sampling done by `jax.random.dirichlet`, without its argument
+  checks and without an extra jit boundary, so XLA can fuse the sampling with
+  the subsequent noise mixing.
+
+  Args:
+    rng_key: random number generator state, the key is consumed.
+    alpha: the concentration parameters. Shape `[num_actions]`.
+    shape: the batch shape of the samples.
+
+  Returns:
+    The samples, of shape `shape + [num_actions]`.
+  """
+  # Low-precision samples are drawn in float32.
+  dtype = jnp.promote_types(alpha.dtype, jnp.float32)
+  # The gammas are sampled in log space, as small alpha can underflow them.
+  log_gammas = jax.random.loggamma(
+      rng_key, alpha.astype(dtype), shape=tuple(shape) + alpha.shape[-1:],
+      dtype=dtype)
+  return jax.nn.softmax(log_gammas, axis=-1)
+
+
+def _prepare_root_logits(rng_key, logits, invalid_actions, *,
+                         dirichlet_fraction, dirichlet_alpha):
+  """Returns the masked root logits, mixed with Dirichlet noise if needed."""
+  if isinstance(dirichlet_fraction, float) and dirichlet_fraction == 0.0:
+    # The noise has no effect, so its sampling is skipped at trace time.
+    return _mask_invalid_actions(
+        _get_logits_from_probs(jax.nn.softmax(logits)), invalid_actions)
+  return _noisy_masked_logits(
+      rng_key, logits, invalid_actions,
+      dirichlet_fraction=dirichlet_fraction,
+      dirichlet_alpha=dirichlet_alpha)
+
+
+@jax.jit
+def _noisy_masked_logits(rng_key, logits, invalid_actions, *,
+                         dirichlet_fraction, dirichlet_alpha):
+  """Returns masked logits of the prior mixed with Dirichlet noise.
+
+  The softmax, the noise mixing, the log and the masking are traced in a single
+  function, so XLA can fuse them into one elementwise kernel.
+  """
+  noisy_probs = _add_dirichlet_noise(
+      rng_key,
+      jax.nn.softmax(logits),
+      dirichlet_fraction=dirichlet_fraction,
+      dirichlet_alpha=dirichlet_alpha)
+  return _mask_invalid_actions(
+      _get_logits_from_probs(noisy_probs), invalid_actions)
+
+
 def _apply_temperature(logits, temperature):
   """Returns `logits / temperature`, supporting also temperature=0."""
   # The max subtraction prevents +inf after dividing by a small temperature.
-  logits = logits - jnp.max(logits, keepdims=True, axis=-1)
+  logits = logits - jax.lax.stop_gradient(
+      jnp.max(logits, keepdims=True, axis=-1))
   tiny = jnp.finfo(logits.dtype).tiny
-  return logits / jnp.maximum(tiny, temperature)
+  # Multiplying by the reciprocal is cheaper than an elementwise division.
+  # The reciprocal of `tiny` is still finite, so temperature=0 keeps working.
+  inv_temperature = 1.0 / jnp.maximum(tiny, temperature)
+  return logits * inv_temperature
@@ -196,6 +196,12 @@ def _compute_mixed_value(raw_value, qvalues, visit_counts, prior_probs):
     An estimator of the state value. Shape `[]`.
   """
   sum_visit_counts = jnp.sum(visit_counts, axis=-1)
+  # Low-precision inputs (e.g., bfloat16) are summed in float32.
+  value_dtype = raw_value.dtype
+  compute_dtype = jnp.promote_types(value_dtype, jnp.float32)
+  raw_value = raw_value.astype(compute_dtype)
+  qvalues = qvalues.astype(compute_dtype)
+  prior_probs = prior_probs.astype(compute_dtype)
   # Ensuring non-nan weighted_q, even if the visited actions have zero
   # prior probability.
   prior_probs = jnp.maximum(jnp.finfo(prior_probs.dtype).tiny, prior_probs)
@@ -206,4 +212,6 @@ def _compute_mixed_value(raw_value, qvalues, visit_counts, prior_probs):
       visit_counts > 0,
       prior_probs * qvalues / sum_probs,
       0.0), axis=-1)
-  return (raw_value + sum_visit_counts * weighted_q) / (sum_visit_counts + 1)
+  mixed_value = (
+      raw_value + sum_visit_counts * weighted_q) / (sum_visit_counts + 1)
+  return mixed_value.astype(value_dtype)
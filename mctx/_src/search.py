@@ -167,7 +167,7 @@ def simulate(
         is_continuing=is_continuing)
 
   node_index = tree.root_index
-  depth = jnp.zeros((), dtype=tree.children_prior_logits.dtype)
+  depth = jnp.zeros((), dtype=jnp.int32)
   initial_state = _SimulationState(
       rng_key=rng_key,
       node_index=tree.NO_PARENT,
@@ -231,9 +231,13 @@ def expand(
       children_index=batch_update(
           tree.children_index, next_node_index, parent_index, action),
       children_rewards=batch_update(
-          tree.children_rewards, step.reward, parent_index, action),
+          tree.children_rewards,
+          step.reward.astype(tree.children_rewards.dtype),
+          parent_index, action),
       children_discounts=batch_update(
-          tree.children_discounts, step.discount, parent_index, action),
+          tree.children_discounts,
+          step.discount.astype(tree.children_discounts.dtype),
+          parent_index, action),
       parents=batch_update(tree.parents, parent_index, next_node_index),
       action_from_parent=batch_update(
           tree.action_from_parent, action, next_node_index))
@@ -272,6 +276,7 @@ def backward(
     leaf_value = reward + tree.children_discounts[parent, action] * leaf_value
     parent_value = (
         tree.node_values[parent] * count + leaf_value) / (count + 1.0)
+    parent_value = parent_value.astype(tree.node_values.dtype)
     children_values = tree.node_values[index]
     children_counts = tree.children_visits[parent, action] + 1
 
@@ -286,7 +291,10 @@ def backward(
     return tree, leaf_value, parent
 
   leaf_index = jnp.asarray(leaf_index, dtype=jnp.int32)
-  loop_state = (tree, tree.node_values[leaf_index], leaf_index)
+  # Low-precision values (e.g., bfloat16) are accumulated in float32.
+  value_dtype = jnp.promote_types(tree.node_values.dtype, jnp.float32)
+  loop_state = (tree, tree.node_values[leaf_index].astype(value_dtype),
+                leaf_index)
   tree, _, _ = jax.lax.while_loop(cond_fun, body_fun, loop_state)
 
   return tree
@@ -326,6 +334,10 @@ def update_tree_node(
 
   # When using max_depth, a leaf can be expanded multiple times.
   new_visit = tree.node_visits[batch_range, node_index] + 1
+  # The tree can store the statistics in a lower precision than the network
+  # outputs (e.g., bfloat16), so the new values are cast explicitly.
+  prior_logits = prior_logits.astype(tree.children_prior_logits.dtype)
+  value = value.astype(tree.node_values.dtype)
   updates = dict(
       children_prior_logits=batch_update(
           tree.children_prior_logits, prior_logits, node_index),
@@ -1,6 +1,7 @@
 """A unit that verifies that muzero_policy_for_action_sequence
  compiles for different number for steps and batch sizes."""
 import functools
+from unittest import mock
 
 import jax
 from absl import logging
@@ -8,9 +9,42 @@ from absl.testing import parameterized
 
 import mctx
 from mctx import PolicyOutput
+from mctx._src import policies
 from mctx._src.tests.tree_test import _prepare_root, _prepare_recurrent_fn
 
 
+@functools.lru_cache(maxsize=16)
+def _prepare_static_fns(qtransform, qtransform_kwargs, num_actions, env_config):
+  """Returns the same `(qtransform, recurrent_fn)` objects for the same config.
+
+  The callables are static arguments of the compiled policy, so reusing them
+  avoids recompilation.
+  """
+  qtransform = functools.partial(
+    getattr(mctx, qtransform), **dict(qtransform_kwargs))
+  recurrent_fn = _prepare_recurrent_fn(num_actions, **dict(env_config))
+  return qtransform, recurrent_fn
+
+
+@functools.lru_cache(maxsize=16)
+def _compiled_policy(num_simulations, num_actions_to_generate):
+  """Returns a jitted `muzero_policy_for_action_sequence` for the given sizes.
+
+  The returned function is shared between test cases using the same sizes, so
+  its compiled executables are reused. The batch size is not part of the key,
+  as `jax.jit` already specializes on the shapes of the `root`. The Python
+  callables and `dirichlet_fraction` are static arguments, so the policy can
+  specialize on them at trace time.
+  """
+  return jax.jit(
+    functools.partial(
+      mctx.muzero_policy_for_action_sequence,
+      num_simulations=num_simulations,
+      num_actions_to_generate=num_actions_to_generate),
+    static_argnames=("recurrent_fn", "stopping_criteria_fn", "qtransform",
+                     "dirichlet_fraction"))
+
+
 ## Uncomment for debugging in order to be able to inspect values in the debugger:
 # from jax.config import config;
 # config.update('jax_disable_jit', True)
@@ -93,6 +127,28 @@ class MuzeroForActionSequenceTest(parameterized.TestCase):
     policy_output = self._run(3, 50, 3, qtransform, f"/tmp/muzero-for-action-sequence-bs3-3x50-{qtransform}.png")
     print(policy_output)
 
+  def test_compiled_policy_skips_dirichlet_noise(self):
+    num_actions = 82
+    qtransform, recurrent_fn = _prepare_static_fns(
+      "qtransform_by_parent_and_siblings", (), num_actions,
+      (("discount", 0.997), ("zero_reward", False)))
+    # A fresh `recurrent_fn` object forces the compiled policy to be retraced,
+    # so the patched sampling would be hit if it was not skipped.
+    recurrent_fn = functools.partial(recurrent_fn)
+    with mock.patch.object(
+        policies, "_noisy_masked_logits",
+        side_effect=AssertionError("The Dirichlet noise was sampled.")):
+      policy_output = _compiled_policy(10, 1)(
+        params=(),
+        rng_key=jax.random.PRNGKey(1),
+        root=_prepare_root(batch_size=1, num_actions=num_actions),
+        recurrent_fn=recurrent_fn,
+        qtransform=qtransform,
+        dirichlet_alpha=0.3,
+        dirichlet_fraction=0.0,
+      )
+    assert (policy_output.action[:, 0] != -1).all()
+
   def _run(self, batch_size, num_simulations, num_actions_to_generate,
            qtransform, draw_graph_path=None, stopping_criteria_fn=None) -> PolicyOutput:
     num_actions = 82
@@ -130,28 +186,27 @@ class MuzeroForActionSequenceTest(parameterized.TestCase):
     else:
       raise ValueError()
 
-    qtransform = functools.partial(getattr(mctx, qtransform), **qtransform_kwargs)
-
-    def run_policy():
-      return mctx.muzero_policy_for_action_sequence(
-        num_actions_to_generate=num_actions_to_generate,
-        num_simulations=num_simulations,
-        # return mctx.muzero_policy(
-        #   num_simulations=num_simulations * num_actions_to_generate,
-        params=(),
-        rng_key=jax.random.PRNGKey(1),
-        root=_prepare_root(batch_size=batch_size, num_actions=num_actions),
-        recurrent_fn=_prepare_recurrent_fn(num_actions, **env_config),
-        qtransform=qtransform,
-        **algorithm_config,
-      )
-
-    policy_output = jax.jit(run_policy)()
+    qtransform, recurrent_fn = _prepare_static_fns(
+      qtransform, tuple(qtransform_kwargs.items()), num_actions,
+      tuple(env_config.items()))
+
+    # The compiled policy is shared between test cases with the same sizes.
+    policy_fn = _compiled_policy(num_simulations, num_actions_to_generate)
+    policy_output = policy_fn(
+      params=(),
+      rng_key=jax.random.PRNGKey(1),
+      root=_prepare_root(batch_size=batch_size, num_actions=num_actions),
+      recurrent_fn=recurrent_fn,
+      qtransform=qtransform,
+      **algorithm_config,
+    )
     logging.info("Done search.")
 
     if draw_graph_path is not None:
       from examples.visualization_demo import convert_tree_to_graph
-      graph = convert_tree_to_graph(policy_output.search_tree)
+      # The graph is built element by element, so the tree is first fetched
+      # to host memory to avoid a device dispatch per indexed element.
+      graph = convert_tree_to_graph(jax.device_get(policy_output.search_tree))
       graph.draw(draw_graph_path, prog="dot")
 
     return policy_output
@@ -14,6 +14,7 @@
 # ==============================================================================
 """Tests for `policies.py`."""
 import functools
+from unittest import mock
 
 from absl.testing import absltest
 import jax
@@ -117,6 +118,88 @@ class PoliciesTest(absltest.TestCase):
         jnp.array([0.25, 0.25, 0.25, 0.25]),
         jax.nn.softmax(masked_logits))
 
+  def test_masked_log_softmax(self):
+    """Tests the fused masking and log-softmax."""
+    logits = jnp.array([1e6, -jnp.inf, 1e6 + 1, -100.0])
+    invalid_actions = jnp.array([0.0, 1.0, 0.0, 1.0])
+    log_probs = policies._masked_log_softmax(logits, invalid_actions)
+    valid_probs = jax.nn.softmax(jnp.array([0.0, 1.0]))
+    np.testing.assert_allclose(
+        jnp.array([valid_probs[0], 0.0, valid_probs[1], 0.0]),
+        jnp.exp(log_probs))
+
+  def test_masked_log_softmax_all_invalid_actions(self):
+    """Tests the fused masking and log-softmax with no valid action."""
+    logits = jnp.array([-jnp.inf, -jnp.inf, -jnp.inf, -jnp.inf])
+    invalid_actions = jnp.array([1.0, 1.0, 1.0, 1.0])
+    log_probs = policies._masked_log_softmax(logits, invalid_actions)
+    np.testing.assert_allclose(
+        jnp.array([0.25, 0.25, 0.25, 0.25]), jnp.exp(log_probs))
+
+  def test_fast_dirichlet(self):
+    """Tests that the samples match `jax.random.dirichlet`."""
+    rng_key = jax.random.PRNGKey(0)
+    alpha = jnp.full([5], 0.3)
+    noise = policies._fast_dirichlet(rng_key, alpha, shape=(3,))
+    expected_noise = jax.random.dirichlet(rng_key, alpha, shape=(3,))
+    np.testing.assert_allclose(expected_noise, noise, rtol=1e-5)
+    np.testing.assert_allclose(jnp.ones(3), noise.sum(axis=-1), rtol=1e-5)
+
+  def test_add_dirichlet_noise_bfloat16(self):
+    """Tests that bfloat16 probs do not round the Dirichlet concentration."""
+    rng_key = jax.random.PRNGKey(0)
+    probs = jnp.full([3, 5], 0.2, dtype=jnp.bfloat16)
+    noise = policies._add_dirichlet_noise(
+        rng_key, probs, dirichlet_alpha=0.3, dirichlet_fraction=1.0)
+    self.assertEqual(jnp.bfloat16, noise.dtype)
+    expected_noise = jax.random.dirichlet(
+        rng_key, jnp.full([5], 0.3), shape=(3,)).astype(jnp.bfloat16)
+    np.testing.assert_array_equal(
+        expected_noise.astype(jnp.float32), noise.astype(jnp.float32))
+
+  def test_noisy_masked_logits(self):
+    """Tests the fused noise mixing and masking against a reference."""
+    rng_key = jax.random.PRNGKey(0)
+    logits = jnp.array([[1.0, -2.0, 0.5, 3.0], [0.0, 0.0, 1.0, -1.0]])
+    invalid_actions = jnp.array([[0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+    noisy_logits = policies._noisy_masked_logits(
+        rng_key, logits, invalid_actions,
+        dirichlet_fraction=0.25, dirichlet_alpha=0.3)
+
+    noise = jax.random.dirichlet(rng_key, jnp.full([4], 0.3), (2,))
+    noisy_probs = 0.75 * jax.nn.softmax(logits) + 0.25 * noise
+    expected_logits = jnp.log(noisy_probs)
+    expected_logits -= jnp.max(expected_logits, axis=-1, keepdims=True)
+    expected_logits = jnp.where(
+        invalid_actions, jnp.finfo(jnp.float32).min, expected_logits)
+    np.testing.assert_allclose(expected_logits, noisy_logits, rtol=1e-5)
+
+  def test_scan_until_stopped_without_jit(self):
+    """Tests that the eager loop stops calling the step function."""
+    calls = []
+
+    def step_fn(carry, x):
+      calls.append(x)
+      return carry + x, None
+
+    with jax.disable_jit():
+      carry, _ = policies._scan_until_stopped(
+          step_fn, jnp.array(0), jnp.ones(5, dtype=jnp.int32),
+          lambda carry: carry >= 1)
+    self.assertLen(calls, 1)
+    np.testing.assert_array_equal(1, carry)
+
+  def test_scan_until_stopped_with_jit(self):
+    """Tests that the traced loop runs all steps through `jax.lax.scan`."""
+
+    def step_fn(carry, x):
+      return carry + x, None
+
+    carry, _ = jax.jit(lambda xs: policies._scan_until_stopped(
+        step_fn, jnp.array(0), xs, lambda carry: carry >= 1))(
+            jnp.ones(5, dtype=jnp.int32))
+    np.testing.assert_array_equal(5, carry)
+
   def test_muzero_policy(self):
     root = mctx.RootFnOutput(
         prior_logits=jnp.array([
@@ -146,6 +229,102 @@ class PoliciesTest(absltest.TestCase):
     np.testing.assert_allclose(expected_action_weights,
                                policy_output.action_weights)
 
+  def test_muzero_policy_without_dirichlet_noise(self):
+    """Tests that dirichlet_fraction=0.0 skips the noise sampling."""
+    root = mctx.RootFnOutput(
+        prior_logits=jnp.array([
+            [-1.0, 0.0, 2.0, 3.0],
+        ]),
+        value=jnp.array([0.0]),
+        embedding=(),
+    )
+    invalid_actions = jnp.array([
+        [0.0, 0.0, 0.0, 1.0],
+    ])
+
+    with mock.patch.object(
+        policies, "_noisy_masked_logits",
+        side_effect=AssertionError("The Dirichlet noise was sampled.")):
+      policy_output = mctx.muzero_policy(
+          params=(),
+          rng_key=jax.random.PRNGKey(0),
+          root=root,
+          recurrent_fn=_make_bandit_recurrent_fn(
+              jnp.zeros_like(root.prior_logits)),
+          num_simulations=1,
+          invalid_actions=invalid_actions,
+          dirichlet_fraction=0.0)
+    expected_prior_probs = jnp.array([
+        jax.nn.softmax(jnp.array([-1.0, 0.0, 2.0]))
+    ])
+    root_prior_probs = jax.nn.softmax(
+        policy_output.search_tree.children_prior_logits[:, 0])
+    np.testing.assert_allclose(expected_prior_probs, root_prior_probs[:, :3],
+                               rtol=1e-6)
+    np.testing.assert_allclose(0.0, root_prior_probs[:, 3], atol=1e-30)
+
+  def test_muzero_policy_pmap(self):
+    """Tests splitting the batch across devices."""
+    num_devices = jax.local_device_count()
+    root = mctx.RootFnOutput(
+        prior_logits=jnp.tile(
+            jnp.array([[[-1.0, 0.0, 2.0, 3.0]]]), (num_devices, 2, 1)),
+        value=jnp.zeros((num_devices, 2)),
+        embedding=(),
+    )
+    rewards = jnp.zeros((2, 4))
+    invalid_actions = jnp.array([
+        [0.0, 0.0, 0.0, 1.0],
+        [0.0, 0.0, 0.0, 1.0],
+    ])
+
+    policy_fn = jax.pmap(
+        functools.partial(
+            mctx.muzero_policy,
+            recurrent_fn=_make_bandit_recurrent_fn(rewards),
+            num_simulations=1,
+            invalid_actions=invalid_actions,
+            dirichlet_fraction=0.0),
+        in_axes=(None, 0, 0))
+    policy_output = policy_fn(
+        (), jax.random.split(jax.random.PRNGKey(0), num_devices), root)
+    np.testing.assert_array_equal(
+        jnp.full((num_devices, 2), 2, dtype=jnp.int32), policy_output.action)
+
+  def test_muzero_policy_bfloat16_tree(self):
+    """Tests storing the search statistics in bfloat16."""
+    root = mctx.RootFnOutput(
+        prior_logits=jnp.array([
+            [-1.0, 0.0, 2.0, 3.0],
+        ], dtype=jnp.bfloat16),
+        value=jnp.array([0.0], dtype=jnp.bfloat16),
+        embedding=(),
+    )
+    # The recurrent_fn keeps producing float32 outputs.
+    rewards = jnp.array([
+        [0.0, 0.0, 1.0, 0.0],
+    ])
+    invalid_actions = jnp.array([
+        [0.0, 0.0, 0.0, 1.0],
+    ])
+
+    policy_output = mctx.muzero_policy(
+        params=(),
+        rng_key=jax.random.PRNGKey(0),
+        root=root,
+        recurrent_fn=_make_bandit_recurrent_fn(rewards),
+        num_simulations=8,
+        invalid_actions=invalid_actions,
+        dirichlet_fraction=0.25)
+    tree = policy_output.search_tree
+    for field in ("raw_values", "node_values", "children_prior_logits",
+                  "children_values", "children_rewards", "children_discounts"):
+      self.assertEqual(jnp.bfloat16, getattr(tree, field).dtype, field)
+    for field in ("node_visits", "children_visits", "children_index"):
+      self.assertEqual(jnp.int32, getattr(tree, field).dtype, field)
+    np.testing.assert_array_equal(8, tree.node_visits[:, 0] - 1)
+    self.assertNotEqual(3, policy_output.action[0])
+
   def test_gumbel_muzero_policy(self):
     root_value = jnp.array([-5.0])
     root = mctx.RootFnOutput(
@@ -0,0 +1,73 @@
+# Copyright 2021 DeepMind Technologies Limited. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for `search.py`."""
+import functools
+
+from absl.testing import absltest
+import jax
+import jax.numpy as jnp
+import mctx
+from mctx._src import action_selection
+
+
+def _make_zero_recurrent_fn(num_actions):
+  """Returns a recurrent_fn with zero rewards, values and logits."""
+
+  def recurrent_fn(params, rng_key, action, embedding):
+    del params, rng_key
+    batch_size = action.shape[0]
+    return mctx.RecurrentFnOutput(
+        reward=jnp.zeros([batch_size]),
+        discount=jnp.ones([batch_size]),
+        prior_logits=jnp.zeros([batch_size, num_actions]),
+        value=jnp.zeros([batch_size]),
+    ), embedding
+
+  return recurrent_fn
+
+
+class SearchTest(absltest.TestCase):
+
+  def test_simulation_depth_is_int32(self):
+    """Tests that the depth does not follow a low-precision logits dtype."""
+    num_actions = 4
+    root = mctx.RootFnOutput(
+        prior_logits=jnp.zeros([1, num_actions], dtype=jnp.bfloat16),
+        value=jnp.zeros([1], dtype=jnp.bfloat16),
+        embedding=(),
+    )
+    depth_dtypes = []
+
+    def interior_action_selection_fn(rng_key, tree, node_index, depth):
+      depth_dtypes.append(depth.dtype)
+      return action_selection.muzero_action_selection(
+          rng_key, tree, node_index, depth)
+
+    mctx.search(
+        params=(),
+        rng_key=jax.random.PRNGKey(0),
+        root=root,
+        recurrent_fn=_make_zero_recurrent_fn(num_actions),
+        root_action_selection_fn=functools.partial(
+            action_selection.muzero_action_selection, depth=0),
+        interior_action_selection_fn=interior_action_selection_fn,
+        num_simulations=8)
+    self.assertNotEmpty(depth_dtypes)
+    for depth_dtype in depth_dtypes:
+      self.assertEqual(jnp.int32, depth_dtype)
+
+
+if __name__ == "__main__":
+  absltest.main()